@@ -1,64 +1,67 @@
 """
 Main script to scrape Markov inventory and upload to PostgreSQL
 """
+import logging
 import os
 import sys
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from scrape_markov_inventory import scrape_markov_inventory
 from upload_to_postgres import upload_inventory_to_postgres, test_connection
 
+logger = logging.getLogger(__name__)
+
 
 def main():
     """
     Main function to orchestrate scraping and uploading inventory data.
     """
-    print("=" * 60)
-    print("Markov Inventory Scraper & PostgreSQL Uploader")
-    print("=" * 60)
-    print(f"Started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    logger.info("Markov Inventory Scraper & PostgreSQL Uploader started")
 
     try:
-        # Step 1: Test database connection
-        print("Step 1: Testing database connection...")
-        if not test_connection():
-            print("ERROR: Database connection failed. Please check DATABASE_URL.")
+        # Fail fast on missing configuration, before logging in to Markov
+        if not os.environ.get('DATABASE_URL'):
+            logger.error("DATABASE_URL not provided. Exiting.")
             return 1
-        print()
 
-        # Step 2: Scrape inventory data
-        print("Step 2: Scraping inventory data from Markov...")
-        inventory_data = scrape_markov_inventory(company=os.getenv('MARKOV_COMPANY', ''), email=os.getenv('MARKOV_EMAIL', ''), password=os.getenv('MARKOV_PASSWORD'))
+        # Step 1: Test database connection in the background; this also
+        # opens the pooled connection the upload will reuse. A failed check
+        # discards its connection, so the next run starts from a fresh one.
+        logger.info("Step 1: Testing database connection (in background)...")
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            connection_future = executor.submit(test_connection)
+
+            # Step 2: Scrape inventory data while the connection is set up
+            logger.info("Step 2: Scraping inventory data from Markov...")
+            inventory_data = scrape_markov_inventory(company=os.getenv('MARKOV_COMPANY', ''), email=os.getenv('MARKOV_EMAIL', ''), password=os.getenv('MARKOV_PASSWORD'))
+
+            if not connection_future.result():
+                logger.error("Database connection failed. Please check DATABASE_URL.")
+                return 1
 
         if not inventory_data:
-            print("WARNING: No inventory data scraped. Exiting.")
+            logger.warning("No inventory data scraped. Exiting.")
             return 0
 
-        print(f"Successfully scraped {len(inventory_data)} inventory items\n")
+        logger.info("Successfully scraped %d inventory rows", len(inventory_data))
 
         # Step 3: Upload to PostgreSQL
-        print("Step 3: Uploading data to PostgreSQL...")
+        logger.info("Step 3: Uploading data to PostgreSQL...")
         records_uploaded = upload_inventory_to_postgres(inventory_data)
 
-        print("\n" + "=" * 60)
-        print(f"✓ SUCCESS: {records_uploaded} records uploaded to database")
-        print("=" * 60)
-        print(f"Completed at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        logger.info("SUCCESS: %d records uploaded to database", records_uploaded)
 
         return 0
 
     except KeyboardInterrupt:
-        print("\n\nProcess interrupted by user")
+        logger.warning("Process interrupted by user")
         return 130
 
-    except Exception as e:
-        print("\n" + "=" * 60)
-        print(f"✗ ERROR: {str(e)}")
-        print("=" * 60)
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("Run failed")
         return 1
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
     exit_code = main()
     sys.exit(exit_code)
@@ -3,11 +3,84 @@ Scrape Inventory Cost from Markov Dashboard
 Converts n8n workflow to Python function
 """
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
+import ijson
 import json
+import logging
+import orjson
 import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# Anti-forgery token rendered in the login form's hidden input
+_TOKEN_RE = re.compile(rb'name="__RequestVerificationToken"[^>]*value="([^"]+)"')
+
+# ijson prefixes of the dashboard response parts used by transform_dashboard_data
+_ENCODE_MAPS_PREFIX = 'ItemData.DataStorageDTO.EncodeMaps'
+_SLICE_DATA_PREFIX = 'ItemData.DataStorageDTO.Slices.item.Data'
+_COLUMNS_PREFIX = 'ViewModel.Columns'
+
+# Owners whose inventory is synced
+_ALLOWED_OWNERS = frozenset({'SHOTTYS', 'IMPACKFUL'})
+
+
+@dataclass(slots=True)
+class InventoryRow:
+    """One dashboard inventory row; rows sharing a key are summed on upload."""
+    key: str
+    gl_group: Optional[str]
+    type: str
+    qty: float
+    unit: str
+    actual_value: float
+    standard_value: float
+    date: str
+    area: str
+    item: str
+
+
+def create_session() -> requests.Session:
+    """
+    Create an HTTP session tuned for the sequential calls to the Markov host.
+
+    Returns:
+        Session with a small keep-alive pool and retries on gateway errors
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[502, 503, 504]
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=retry)
+    session.mount('https://', adapter)
+    # Advertise gzip/deflate, plus br when a brotli decoder is installed
+    session.headers.update(make_headers(accept_encoding=True))
+    return session
+
+
+# Shared session so repeated scrapes in one process reuse the connection
+_session: Optional[requests.Session] = None
+
+
+def get_session() -> requests.Session:
+    """
+    Get the shared scraper session, creating it on first use.
+
+    Returns:
+        Session from create_session, reused across calls
+    """
+    global _session
+    if _session is None:
+        _session = create_session()
+    return _session
 
 
 def scrape_markov_inventory(
@@ -15,8 +88,9 @@ def scrape_markov_inventory(
     email: str,
     password: str,
     dashboard_id: str = "100-ShottysLLC",
-    item_id: str = "gridDashboardItem6"
-) -> List[Dict]:
+    item_id: str = "gridDashboardItem6",
+    session: Optional[requests.Session] = None
+) -> List[InventoryRow]:
     """
     Scrape inventory data from Markov dashboard.
 
@@ -26,35 +100,39 @@ def scrape_markov_inventory(
         password: Login password
         dashboard_id: Dashboard ID to fetch data from
         item_id: Dashboard item ID
+        session: HTTP session to use (defaults to the shared session)
 
     Returns:
-        List of inventory records with aggregated quantities and values
+        List of inventory rows, one per dashboard row (not yet aggregated)
     """
     base_url = "https://mcs.mar-kov.com/MCS_7-22-00_Dashboard"
     login_url = f"{base_url}/Identity/Account/Login?ReturnUrl=/100-SHOTTYSLLC"
     logout_url = f"{base_url}/Identity/Account/Logout"
     dashboard_api_url = f"{base_url}/api/dashboard/data/DashboardItemGetAction"
 
-    session = requests.Session()
+    if session is None:
+        session = get_session()
+
+    # Start from a clean cookie jar; the connection itself is kept alive
+    session.cookies.clear()
 
     try:
         # Step 1: Get Login Form to extract CSRF token
-        print("Fetching login form...")
+        logger.info("Fetching login form...")
         login_form_response = session.get(login_url)
         login_form_response.raise_for_status()
 
         # Extract the __RequestVerificationToken from the HTML
-        soup = BeautifulSoup(login_form_response.text, 'html.parser')
-        verifier_input = soup.find('input', {'name': '__RequestVerificationToken'})
+        token_match = _TOKEN_RE.search(login_form_response.content)
 
-        if not verifier_input or 'value' not in verifier_input.attrs:
+        if not token_match:
             raise ValueError("Could not find verification token in login form")
 
-        verification_token = verifier_input['value']
+        verification_token = token_match.group(1).decode('ascii')
         initial_cookies = login_form_response.cookies
 
         # Step 2: Login to Markov
-        print("Logging in...")
+        logger.info("Logging in...")
         login_data = {
             'Input.Company': company,
             'Input.Email': email,
@@ -72,42 +150,107 @@ def scrape_markov_inventory(
             raise ValueError(f"Login failed with status code: {login_response.status_code}")
 
         # Step 3: Get Dashboard Data
-        print("Fetching dashboard data...")
+        logger.info("Fetching dashboard data...")
         dashboard_params = {
             'dashboardId': dashboard_id,
             'itemId': item_id
         }
 
-        dashboard_response = session.get(
+        with session.get(
             dashboard_api_url,
-            params=dashboard_params
-        )
-        dashboard_response.raise_for_status()
-        dashboard_data = dashboard_response.json()
-
-        # Step 4: Transform Data
-        print("Transforming data...")
-        transformed_data = transform_dashboard_data(dashboard_data)
-
-        # Step 5: Logout
-        print("Logging out...")
-        session.get(logout_url)
+            params=dashboard_params,
+            stream=True
+        ) as dashboard_response:
+            dashboard_response.raise_for_status()
+            logger.info(
+                "Dashboard response encoding: %s",
+                dashboard_response.headers.get('Content-Encoding', 'identity')
+            )
+            dashboard_response.raw.decode_content = True
+            dashboard_data = read_dashboard_stream(dashboard_response.raw)
+
+        # Step 4: Logout in the background; the data is already downloaded
+        logger.info("Logging out...")
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            logout_future = executor.submit(session.get, logout_url)
+
+            # Step 5: Transform Data while the logout request is in flight
+            logger.info("Transforming data...")
+            transformed_data = transform_dashboard_data(dashboard_data)
+
+            logout_future.result()
 
         return transformed_data
 
-    except Exception as e:
-        print(f"Error scraping Markov inventory: {e}")
-        # Attempt logout even on error
+    except Exception:
+        # Attempt logout even on error; the caller reports the failure
         try:
             session.get(logout_url)
         except:
             pass
         raise
-    finally:
-        session.close()
 
 
-def transform_dashboard_data(dashboard_data: Dict) -> List[Dict]:
+def read_dashboard_stream(stream) -> Dict:
+    """
+    Incrementally parse a dashboard API response.
+
+    Only the parts used by transform_dashboard_data are kept: the encode maps,
+    the column definitions and the keys of the first slice. Slice values are
+    never used and are skipped as they stream past.
+
+    Args:
+        stream: File-like object yielding the raw JSON response body
+
+    Returns:
+        Dashboard data with the same shape as the full JSON response
+    """
+    encode_maps = {}
+    columns = []
+    slice_data = {}
+    slice_done = False
+
+    builder = None
+    building = None
+
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == building and event in ('end_map', 'end_array'):
+                if building == _ENCODE_MAPS_PREFIX:
+                    encode_maps = builder.value
+                else:
+                    columns = builder.value
+                builder = None
+            continue
+
+        if prefix in (_ENCODE_MAPS_PREFIX, _COLUMNS_PREFIX) and event in ('start_map', 'start_array'):
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+            building = prefix
+        elif prefix == _SLICE_DATA_PREFIX and not slice_done:
+            if event == 'map_key':
+                slice_data[value] = None
+            elif event == 'end_map':
+                slice_done = True
+
+    return {
+        'ItemData': {
+            'DataStorageDTO': {
+                'EncodeMaps': encode_maps,
+                'Slices': [{'Data': slice_data}]
+            }
+        },
+        'ViewModel': {'Columns': columns}
+    }
+
+
+def _to_float(value) -> float:
+    """Convert an encoded cell value to float, treating missing/empty as 0."""
+    return float(value) if value else 0.0
+
+
+def transform_dashboard_data(dashboard_data: Dict) -> List[InventoryRow]:
     """
     Transform raw dashboard data into structured inventory records.
 
@@ -115,7 +258,7 @@ def transform_dashboard_data(dashboard_data: Dict) -> List[Dict]:
         dashboard_data: Raw JSON response from dashboard API
 
     Returns:
-        List of aggregated inventory records
+        List of inventory rows; rows sharing a key are summed on upload
     """
     # Calculate date for yesterday (based on the workflow logic)
     date_now = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
@@ -126,10 +269,13 @@ def transform_dashboard_data(dashboard_data: Dict) -> List[Dict]:
     encode_maps = data_storage.get('EncodeMaps', {})
 
     columns = dashboard_data.get('ViewModel', {}).get('Columns', [])
-    column_mappings = [
-        {'name': col.get('Caption'), 'dataId': col.get('DataId')}
-        for col in columns
-    ]
+
+    # Resolve each column's name and encode map once, as parallel lists
+    # indexed by position in the slice key
+    column_names = [col.get('Caption') for col in columns]
+    column_maps = [encode_maps.get(col.get('DataId')) for col in columns]
+    column_map_lens = [len(m) if m is not None else 0 for m in column_maps]
+    column_count = len(columns)
 
     # Owner mapping
     owner_map = {
@@ -138,96 +284,57 @@ def transform_dashboard_data(dashboard_data: Dict) -> List[Dict]:
         "100374": "IMPACKFUL"
     }
 
-    # Process raw data into objects
-    output = []
-    for item_key, item_value in slices_data.items():
-        if not item_key.startswith('['):
+    # Process raw data into inventory rows; rows sharing a key are
+    # aggregated by the database on upload
+    inventory_items = []
+    loads = orjson.loads
+    for item_key in slices_data:
+        if item_key[:1] != '[':
             continue
 
         try:
-            item_arr = json.loads(item_key)
-        except json.JSONDecodeError:
+            item_arr = loads(item_key)
+        except orjson.JSONDecodeError:
             continue
 
         obj = {}
         for i, value in enumerate(item_arr):
-            if value == -1:
-                continue
-
-            if i >= len(column_mappings):
+            if value == -1 or i >= column_count:
                 continue
 
-            column = column_mappings[i]
-            data_id = column['dataId']
+            encode_map = column_maps[i]
+            if encode_map is not None and value < column_map_lens[i]:
+                obj[column_names[i]] = encode_map[value]
 
-            try:
-                if data_id in encode_maps and value < len(encode_maps[data_id]):
-                    obj[column['name']] = encode_maps[data_id][value]
-            except (KeyError, IndexError):
-                continue
         # Map owner if present
-        if 'Owner' in obj:
-            owner_value = str(obj['Owner'])
-            if owner_value in owner_map:
-                obj['Owner'] = owner_map[owner_value]
-
-
-        # Filter by date
-        if 'Date' in obj and obj['Date'].startswith(date_now) and obj['Owner'] in ['SHOTTYS', 'IMPACKFUL']:
-            output.append(obj)
-
-    # Convert to inventory format and aggregate
-    inventory_items = []
-    for d in output:
-        item_code = d.get('ItemCode', '')
-        sublot = d.get('Sublot', '0')
-        key = f"{item_code}-{sublot}-{d.get('Owner', '')}-{d.get('Date', '')[:10]}"
-        date = d.get('Date', '')[:10]
-        qty = float(d.get('Qty', 0)) if d.get('Qty') else 0
-        actual_value = float(d.get('ActualValue', 0)) if d.get('ActualValue') else 0
-        standard_value = float(d.get('StandardValue', 0)) if d.get('StandardValue') else 0
-        actual_unit_cost = 0
-        standard_unit_cost = 0
-        if qty and actual_value:
-            actual_unit_cost = actual_value / qty
-        if qty and standard_value:
-            standard_unit_cost = standard_value / qty
-        inventory_items.append({
-            'key': key,
-            'date': date,
-            'item': item_code,
-            'area': d.get('Owner'),
-            'qty': qty,
-            'actual_value': actual_value,
-            'actual_unit_cost': actual_unit_cost,
-            'standard_value': standard_value,
-            'standard_unit_cost': standard_unit_cost,
-            'gl_group': d.get('GLGroup'),
-            'type': d.get('Type', ''),
-            'unit': d.get('Unit', '')
-        })
-
-    # Aggregate by ID (itemCode-sublot combination)
-    aggregated = {}
-    for item in inventory_items:
-        item_id = item['key']
-        if item_id in aggregated:
-            aggregated[item_id]['qty'] += item['qty']
-            aggregated[item_id]['actual_value'] += item['actual_value']
-            aggregated[item_id]['standard_value'] += item['standard_value']
-            aggregated[item_id]['actual_unit_cost'] = aggregated[item_id]['actual_value'] / aggregated[item_id]['qty']
-            aggregated[item_id]['standard_unit_cost'] = aggregated[item_id]['standard_value'] / aggregated[item_id]['qty']
-
-        else:
-            aggregated[item_id] = item
-
-    # Sort by date (most recent first)
-    sorted_items = sorted(aggregated.values(), key=lambda x: x['date'], reverse=True)
-    
-    return sorted_items
-
-
-def write_inventory_to_file(inventory_data: List[Dict], filename: str = None) -> str:
+        owner_val = obj.get('Owner')
+        if owner_val is not None:
+            owner_val = owner_map.get(str(owner_val), owner_val)
+
+        # Filter by owner and date, and convert to inventory format
+        if owner_val in _ALLOWED_OWNERS and obj.get('Date', '').startswith(date_now):
+            item_code = obj.get('ItemCode', '')
+            sublot = obj.get('Sublot', '0')
+            date = obj['Date'][:10]
+            # Encoded item codes and sublots may be numbers, hence str()
+            key = '-'.join((str(item_code), str(sublot), owner_val, date))
+            inventory_items.append(InventoryRow(
+                key=key,
+                gl_group=obj.get('GLGroup'),
+                type=obj.get('Type', ''),
+                qty=_to_float(obj.get('Qty')),
+                unit=obj.get('Unit', ''),
+                actual_value=_to_float(obj.get('ActualValue')),
+                standard_value=_to_float(obj.get('StandardValue')),
+                date=date,
+                area=owner_val,
+                item=item_code
+            ))
+
+    return inventory_items
+
+
+def write_inventory_to_file(inventory_data: List[InventoryRow], filename: str = None) -> str:
     """
     Write inventory data to a JSON file.
     
@@ -246,20 +353,17 @@ def write_inventory_to_file(inventory_data: List[Dict], filename: str = None) ->
     if not filename.endswith('.json'):
         filename += '.json'
     
-    try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(inventory_data, f, indent=2, ensure_ascii=False)
-        
-        print(f"Inventory data written to: {filename}")
-        print(f"Total records written: {len(inventory_data)}")
-        return filename
-        
-    except Exception as e:
-        print(f"Error writing inventory data to file: {e}")
-        raise
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump([asdict(row) for row in inventory_data], f, indent=2, ensure_ascii=False)
+
+    logger.info("Inventory data written to: %s", filename)
+    logger.info("Total records written: %d", len(inventory_data))
+    return filename
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
     # Example usage
     try:
         inventory_data = scrape_markov_inventory(company=os.getenv('MARKOV_COMPANY', ''), email=os.getenv('MARKOV_EMAIL', ''), password=os.getenv('MARKOV_PASSWORD'))
@@ -270,7 +374,7 @@ if __name__ == "__main__":
         
         print("\nSample records:")
         for item in inventory_data[:3]:
-            print(json.dumps(item, indent=2))
+            print(json.dumps(asdict(item), indent=2))
             
     except Exception as e:
         print(f"Failed to scrape inventory: {e}")
@@ -2,11 +2,75 @@
 Upload inventory data to PostgreSQL database on Railway
 """
 import psycopg2
-from psycopg2.extras import execute_values
-from typing import List, Dict
+from psycopg2.extras import execute_batch
+from psycopg2.pool import SimpleConnectionPool
+from typing import TYPE_CHECKING, List, Dict
+import csv
+import io
+import logging
 import os
 from datetime import datetime, timedelta
 
+if TYPE_CHECKING:
+    from scrape_markov_inventory import InventoryRow
+
+logger = logging.getLogger(__name__)
+
+# NULL marker written to the COPY stream; keeps None distinct from ''
+COPY_NULL = '\\N'
+
+# Rows per round-trip when COPY is unavailable and execute_batch is used
+BATCH_PAGE_SIZE = 500
+
+# Server-side prepared statement used by the execute_batch fallback
+STAGING_INSERT_STATEMENT = 'inventory_cost_staging_insert'
+
+# Connection pools keyed by database URL, created on first use
+_pools: Dict[str, SimpleConnectionPool] = {}
+
+
+def get_connection_pool(database_url: str) -> SimpleConnectionPool:
+    """
+    Get the connection pool for a database, creating it on first use.
+
+    Connections are returned to the pool rather than closed, so repeated
+    runs in one process reuse the same server connection.
+
+    Args:
+        database_url: PostgreSQL connection string
+
+    Returns:
+        Connection pool for database_url
+    """
+    pool = _pools.get(database_url)
+    if pool is None:
+        pool = SimpleConnectionPool(1, 4, database_url)
+        _pools[database_url] = pool
+    return pool
+
+
+def get_pooled_connection(pool: SimpleConnectionPool):
+    """
+    Take a connection from the pool, replacing it if it is no longer usable.
+
+    Pooled connections can be dropped by the server or a proxy while idle,
+    so each one is checked before use and discarded if the check fails.
+
+    Args:
+        pool: Connection pool from get_connection_pool
+
+    Returns:
+        Open database connection; return it with pool.putconn
+    """
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+    except psycopg2.Error:
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    return conn
+
 
 def cleanup_old_records(cursor, date_to_keep: str) -> int:
     """
@@ -30,20 +94,81 @@ def cleanup_old_records(cursor, date_to_keep: str) -> int:
     cursor.execute(delete_query, (date_to_keep,))
     deleted_count = cursor.rowcount
     
-    print(f"Cleaned up {deleted_count} old records (kept only end-of-month and yesterday's records)")
+    logger.info("Cleaned up %d old records (kept only end-of-month and yesterday's records)", deleted_count)
     return deleted_count
 
 
+def copy_records_to_staging(cursor, records: List[tuple]) -> None:
+    """
+    Stream records into the staging table using COPY FROM STDIN.
+
+    Args:
+        cursor: Database cursor with inventory_cost_staging created
+        records: Row tuples in staging column order
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for record in records:
+        writer.writerow([COPY_NULL if value is None else value for value in record])
+    buffer.seek(0)
+
+    copy_query = f"""
+        COPY inventory_cost_staging (
+            key, gl_group, type, qty, unit,
+            actual_value, standard_value, date, area, item
+        )
+        FROM STDIN WITH (FORMAT CSV, NULL '{COPY_NULL}')
+    """
+    cursor.copy_expert(copy_query, buffer)
+
+
+def insert_records_to_staging(cursor, records: List[tuple], page_size: int = BATCH_PAGE_SIZE) -> None:
+    """
+    Insert records into the staging table in batches of page_size.
+
+    Fallback for connections where COPY is not supported (e.g. some poolers).
+
+    Args:
+        cursor: Database cursor with inventory_cost_staging created
+        records: Row tuples in staging column order
+        page_size: Number of rows sent per round-trip
+    """
+    # Prepare the insert once per connection; pooled connections keep it
+    # across runs. It is re-analysed automatically when the temp table is
+    # recreated.
+    cursor.execute(
+        "SELECT 1 FROM pg_prepared_statements WHERE name = %s",
+        (STAGING_INSERT_STATEMENT,)
+    )
+    if cursor.fetchone() is None:
+        cursor.execute(f"""
+            PREPARE {STAGING_INSERT_STATEMENT} (
+                text, text, text, numeric, text,
+                numeric, numeric, date, text, text
+            ) AS
+            INSERT INTO inventory_cost_staging (
+                key, gl_group, type, qty, unit,
+                actual_value, standard_value, date, area, item
+            )
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+        """)
+
+    execute_query = f"EXECUTE {STAGING_INSERT_STATEMENT} (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+    execute_batch(cursor, execute_query, records, page_size=page_size)
+
+
 def upload_inventory_to_postgres(
-    inventory_data: List[Dict],
-    database_url: str = None
+    inventory_data: List['InventoryRow'],
+    database_url: str = None,
+    use_copy: bool = True
 ) -> int:
     """
     Upload inventory data to PostgreSQL database on Railway.
 
     Args:
-        inventory_data: List of inventory records from scraper
+        inventory_data: List of inventory rows from scraper, summed by key on upload
         database_url: PostgreSQL connection string (defaults to DATABASE_URL env var)
+        use_copy: Load rows with COPY; set False to fall back to execute_batch
 
     Returns:
         Number of records uploaded
@@ -57,42 +182,78 @@ def upload_inventory_to_postgres(
     if not database_url:
         raise ValueError("DATABASE_URL not provided and not found in environment")
 
+    pool = None
     conn = None
     cursor = None
+    failed = False
 
     try:
         # Connect to PostgreSQL
-        print(f"Connecting to PostgreSQL database...")
-        conn = psycopg2.connect(database_url)
+        logger.info("Connecting to PostgreSQL database...")
+        pool = get_connection_pool(database_url)
+        conn = get_pooled_connection(pool)
         cursor = conn.cursor()
 
         # Prepare data for insertion
-        # Map fields to match database schema
+        # Map fields to match the staging table
         records = []
         for item in inventory_data:
             record = (
-                item.get('key'),              # key (primary key)
-                item.get('gl_group'),         # gl_group
-                item.get('type'),             # type
-                item.get('qty'),              # qty
-                item.get('unit'),             # unit
-                item.get('actual_unit_cost'), # actual_unit_cost
-                item.get('actual_value'),     # actual_value
-                item.get('standard_value'),   # standard_value
-                item.get('standard_unit_cost'), # standard_unit_cost
-                item.get('date'),             # date
-                item.get('area'),             # area
-                item.get('item')              # item
+                item.key,
+                item.gl_group,
+                item.type,
+                item.qty,
+                item.unit,
+                item.actual_value,
+                item.standard_value,
+                item.date,
+                item.area,
+                item.item
             )
             records.append(record)
 
-        # Use INSERT ... ON CONFLICT to handle duplicates (upsert)
+        # The data is regenerated by every scrape, so don't wait for the WAL
+        # flush on commit; the temp staging table below is not WAL-logged
+        cursor.execute("SET LOCAL synchronous_commit = OFF")
+
+        # Stage raw rows in a temp table; numeric columns avoid money's text
+        # input rules during COPY, the final INSERT casts them
+        cursor.execute("""
+            CREATE TEMP TABLE inventory_cost_staging (
+                key text,
+                gl_group text,
+                type text,
+                qty numeric,
+                unit text,
+                actual_value numeric,
+                standard_value numeric,
+                date date,
+                area text,
+                item text
+            ) ON COMMIT DROP
+        """)
+
+        logger.info("Uploading %d rows to database...", len(records))
+        if use_copy:
+            copy_records_to_staging(cursor, records)
+        else:
+            insert_records_to_staging(cursor, records)
+
+        # Aggregate staged rows by key and upsert with INSERT ... ON CONFLICT
         upsert_query = """
             INSERT INTO inventory_cost (
                 key, gl_group, type, qty, unit,
                 actual_unit_cost, actual_value, standard_value, standard_unit_cost, date, area, item
             )
-            VALUES %s
+            SELECT
+                key, MIN(gl_group), MIN(type), SUM(qty), MIN(unit),
+                COALESCE(SUM(actual_value) / NULLIF(SUM(qty), 0), 0),
+                SUM(actual_value),
+                SUM(standard_value),
+                COALESCE(SUM(standard_value) / NULLIF(SUM(qty), 0), 0),
+                MIN(date), MIN(area), MIN(item)
+            FROM inventory_cost_staging
+            GROUP BY key
             ON CONFLICT (key)
             DO UPDATE SET
                 gl_group = EXCLUDED.gl_group,
@@ -107,9 +268,8 @@ def upload_inventory_to_postgres(
                 area = EXCLUDED.area,
                 item = EXCLUDED.item
         """
-
-        print(f"Uploading {len(records)} records to database...")
-        execute_values(cursor, upsert_query, records)
+        cursor.execute(upsert_query)
+        upserted_count = cursor.rowcount
 
         # Clean up old records (keep only end-of-month and yesterday's records)
         yesterday_date = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
@@ -117,27 +277,30 @@ def upload_inventory_to_postgres(
 
         # Commit the transaction
         conn.commit()
-        print(f"Successfully uploaded {len(records)} records and cleaned up {deleted_count} old records")
+        logger.info(
+            "Successfully uploaded %d records and cleaned up %d old records",
+            upserted_count, deleted_count
+        )
 
-        return len(records)
+        return upserted_count
 
-    except psycopg2.Error as e:
-        if conn:
+    except psycopg2.Error:
+        failed = True
+        if conn and not conn.closed:
             conn.rollback()
-        print(f"Database error: {e}")
         raise
 
-    except Exception as e:
-        if conn:
+    except Exception:
+        if conn and not conn.closed:
             conn.rollback()
-        print(f"Error uploading to PostgreSQL: {e}")
         raise
 
     finally:
         if cursor:
             cursor.close()
         if conn:
-            conn.close()
+            # Don't hand a connection that hit a database error back out
+            pool.putconn(conn, close=failed)
 
 
 def cleanup_database(database_url: str = None) -> int:
@@ -156,13 +319,16 @@ def cleanup_database(database_url: str = None) -> int:
     if not database_url:
         raise ValueError("DATABASE_URL not provided and not found in environment")
 
+    pool = None
     conn = None
     cursor = None
+    failed = False
 
     try:
         # Connect to PostgreSQL
-        print(f"Connecting to PostgreSQL database...")
-        conn = psycopg2.connect(database_url)
+        logger.info("Connecting to PostgreSQL database...")
+        pool = get_connection_pool(database_url)
+        conn = get_pooled_connection(pool)
         cursor = conn.cursor()
 
         # Clean up old records
@@ -171,26 +337,26 @@ def cleanup_database(database_url: str = None) -> int:
 
         # Commit the transaction
         conn.commit()
-        print(f"Successfully cleaned up {deleted_count} old records")
+        logger.info("Successfully cleaned up %d old records", deleted_count)
         return deleted_count
 
-    except psycopg2.Error as e:
-        if conn:
+    except psycopg2.Error:
+        failed = True
+        if conn and not conn.closed:
             conn.rollback()
-        print(f"Database error: {e}")
         raise
 
-    except Exception as e:
-        if conn:
+    except Exception:
+        if conn and not conn.closed:
             conn.rollback()
-        print(f"Error cleaning up database: {e}")
         raise
 
     finally:
         if cursor:
             cursor.close()
         if conn:
-            conn.close()
+            # Don't hand a connection that hit a database error back out
+            pool.putconn(conn, close=failed)
 
 
 def test_connection(database_url: str = None) -> bool:
@@ -207,25 +373,34 @@ def test_connection(database_url: str = None) -> bool:
         database_url = os.environ.get('DATABASE_URL')
 
     if not database_url:
-        print("DATABASE_URL not provided")
+        logger.error("DATABASE_URL not provided")
         return False
 
+    pool = None
+    conn = None
+    failed = False
+
     try:
-        conn = psycopg2.connect(database_url)
-        cursor = conn.cursor()
-        cursor.execute("SELECT version();")
-        version = cursor.fetchone()
-        print(f"Connected to PostgreSQL: {version[0]}")
-        cursor.close()
-        conn.close()
+        pool = get_connection_pool(database_url)
+        conn = get_pooled_connection(pool)
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT version();")
+            version = cursor.fetchone()
+        logger.info("Connected to PostgreSQL: %s", version[0])
         return True
     except Exception as e:
-        print(f"Connection failed: {e}")
+        failed = True
+        logger.error("Connection failed: %s", e)
         return False
+    finally:
+        if conn:
+            pool.putconn(conn, close=failed)
 
 
 if __name__ == "__main__":
     import sys
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
     
     if len(sys.argv) > 1 and sys.argv[1] == "cleanup":
         # Test cleanup functionality